@@ -9,15 +9,27 @@ Author: venu madhav (2025) — hybrid exits added
 import os
 import sys
 import time
-import json
+import asyncio
 import threading
+from concurrent.futures import ThreadPoolExecutor
+import queue
 import logging
+import logging.handlers
 import datetime as dt
-import tempfile
+import io
+import hashlib
+import itertools
+import base64
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
 
-import pandas as pd
 import numpy as np
+import xlsxwriter
+import orjson
+from cachetools import TTLCache
 from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse
 from fyers_apiv3 import fyersModel
 import uvicorn
 import smtplib
@@ -25,23 +37,28 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
 
+from refresh_token import fetch_access_token, FYERS_REFRESH_TOKEN
+
 # ---------------- CONFIGURATION ----------------
 FYERS_ID = os.getenv("FYERS_CLIENT_ID", "")
 FYERS_SECRET = os.getenv("FYERS_CLIENT_SECRET", "")
 FYERS_REDIRECT_URI = os.getenv("FYERS_REDIRECT_URI", "https://www.google.com")
 FYERS_ACCESS_TOKEN = os.getenv("FYERS_ACCESS_TOKEN", "")
+TOKEN_REFRESH_LEAD_SEC = int(os.getenv("TOKEN_REFRESH_LEAD_SEC", 600))  # refresh this long before expiry
+TOKEN_RETRY_SEC = 60  # minimum wait before trying another refresh
 
 EMAIL_USER = os.getenv("EMAIL_USER", "")
 EMAIL_PASS = os.getenv("EMAIL_PASS", "")
 EMAIL_TO = os.getenv("EMAIL_TO", "")
+EMAIL_RECIPIENTS = [addr.strip() for addr in EMAIL_TO.split(",") if addr.strip()]  # EMAIL_TO may be comma-separated
 
 TRADE_MODE = os.getenv("TRADE_MODE", "TEST").upper()  # TEST or REAL
 STOP_METHOD = os.getenv("STOP_METHOD", "ATR")
 ATR_PERIOD = int(os.getenv("ATR_PERIOD", 14))
 ATR_MULT = float(os.getenv("ATR_MULT", 1.5))
 ATR_TARGET_MULT = float(os.getenv("ATR_TARGET_MULT", 2.0))
-TARGET_PCT = float(os.getenv("TARGET_PCT", 1.5))
-SL_PCT = float(os.getenv("SL_PCT", 0.8))
+TARGET_PCT = float(os.getenv("TARGET_PCT", 1.5))  # percent (1.5 = 1.5%), not a fraction
+SL_PCT = float(os.getenv("SL_PCT", 0.8))  # percent below entry for the fallback stop
 
 # New hybrid/trailing/time configs
 USE_CANDLE_SL = os.getenv("USE_CANDLE_SL", "TRUE").upper() == "TRUE"
@@ -49,30 +66,128 @@ TRAIL_TYPE = os.getenv("TRAIL_TYPE", "PCT").upper()  # "PCT" or "ATR"
 TRAIL_PCT = float(os.getenv("TRAIL_PCT", 0.5))      # percent to trail once started
 TRAIL_START_PCT = float(os.getenv("TRAIL_START_PCT", 0.5))  # percent move to start trailing
 TIME_EXIT_MIN = int(os.getenv("TIME_EXIT_MIN", 45))  # minutes to auto-exit
+MONITOR_INTERVAL_SEC = float(os.getenv("MONITOR_INTERVAL_SEC", 15))  # exit monitor tick period
+
+# Derived multipliers/prefixes — config is fixed for the process lifetime
+SL_FACTOR = 1 - SL_PCT / 100
+TARGET_FACTOR = 1 + TARGET_PCT / 100
+TRAIL_FACTOR = 1 - TRAIL_PCT / 100
+TRAIL_START_FACTOR = 1 + TRAIL_START_PCT / 100
+EXIT_STATUS_PREFIX = f"{TRADE_MODE}_EXIT"
+
+LTP_CACHE_TTL = float(os.getenv("LTP_CACHE_TTL", 2))  # seconds a fetched LTP is reused
+QUOTES_BATCH_SIZE = 50  # max symbols per fyers.quotes call
+LTP_WORKERS = int(os.getenv("LTP_WORKERS", 8))  # threads for single-symbol LTP fallbacks
+QUOTES_FAIL_MAX = int(os.getenv("QUOTES_FAIL_MAX", 5))  # consecutive quote failures before backing off
+QUOTES_COOLDOWN_SEC = float(os.getenv("QUOTES_COOLDOWN_SEC", 30))  # how long quote calls are skipped
+ORDER_WORKERS = int(os.getenv("ORDER_WORKERS", 8))  # threads handling incoming alerts
+BROKER_API_LIMIT = int(os.getenv("BROKER_API_LIMIT", 4))  # concurrent fyers order calls
+ALERT_DEDUPE_TTL = float(os.getenv("ALERT_DEDUPE_TTL", 30))  # seconds an identical alert is ignored
 
 DEFAULT_INTERVAL = "5"   # options: "5", "15", "30", "60", "D"
 LOOKBACK_DAYS_ENTRY = 7
 LOOKBACK_DAYS_EXIT = 1
+BAR_SECONDS = int(DEFAULT_INTERVAL) * 60 if DEFAULT_INTERVAL.isdigit() else 86400
+REPORT_AT = (15, 31)  # IST hour, minute for the daily email summary
+RESET_AT = (9, 0)  # IST hour, minute to clear positions for the new day
 
 # ---------------- LOGGING ----------------
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s | %(levelname)s | %(message)s",
-    handlers=[logging.StreamHandler(sys.stdout)]
-)
+# Callers only enqueue records; a single listener thread formats and writes them to stdout.
+log_queue = queue.SimpleQueue()
+_queue_handler = logging.handlers.QueueHandler(log_queue)
+_queue_handler.setFormatter(logging.Formatter("%(message)s"))
+_stream_handler = logging.StreamHandler(sys.stdout)
+_stream_handler.setFormatter(logging.Formatter("%(asctime)s | %(levelname)s | %(message)s"))
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), handlers=[_queue_handler])
+log_listener = logging.handlers.QueueListener(log_queue, _stream_handler)
+log_listener.start()
 
 # ---------------- GLOBALS ----------------
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 fyers = None
-open_positions = {}  # In-memory positions keyed by normalized symbol
+open_positions = {}  # In-memory Position records keyed by normalized symbol
+pending_entries = {}  # symbol -> claim token while its entry is being set up
 lock = threading.Lock()
+order_pool = ThreadPoolExecutor(max_workers=ORDER_WORKERS, thread_name_prefix="order")
+broker_slots = threading.BoundedSemaphore(BROKER_API_LIMIT)
+ltp_pool = ThreadPoolExecutor(max_workers=LTP_WORKERS, thread_name_prefix="ltp")
+app_loop = None  # the running FastAPI event loop, set in startup_event
+monitor_task = None  # asyncio task running monitor_exits on the app event loop
+position_opened = asyncio.Event()  # wakes an idle monitor_exits when a position is added
+token_refresh_task = None  # asyncio task renewing the access token ahead of expiry
+heartbeat_task = None  # asyncio task logging liveness every 5 minutes
+report_task = None  # asyncio task running daily_report_scheduler
+ltp_cache = TTLCache(maxsize=512, ttl=LTP_CACHE_TTL)  # fyers symbol -> last traded price
+ltp_cache_lock = threading.Lock()
+quotes_failures = 0  # consecutive failed fyers.quotes calls
+quotes_open_until = 0.0  # time.monotonic() before which quote calls are skipped; 0.0 while closed
+quotes_probing = False  # a half-open probe call is in flight
+quotes_breaker_lock = threading.Lock()
+candle_cache = TTLCache(maxsize=256, ttl=BAR_SECONDS)
+candle_cache_lock = threading.Lock()
+seen_alerts = TTLCache(maxsize=1024, ttl=ALERT_DEDUPE_TTL)  # payload digest -> True (event loop only)
+
+
+@dataclass(slots=True)
+class Position:
+    """
+    One tracked trade. stop_loss, status and the exit_* fields are updated in place under `lock`.
+    """
+    symbol: str
+    fyers_symbol: str
+    entry_price: float
+    atr: Optional[float]  # None when get_atr had too little history; ATR trailing is skipped
+    stop_loss: float
+    target: float
+    trail_start: float  # price at which trailing kicks in
+    qty: int
+    timestamp: str
+    status: str
+    exit_price: float = None
+    exit_reason: str = None
+    exit_timestamp: str = None
+
+
+@dataclass(slots=True)
+class Candles:
+    """
+    OHLCV history as parallel contiguous float64 arrays, one element per bar (oldest first).
+    """
+    ts: np.ndarray
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+    vol: np.ndarray
+
+    def __len__(self):
+        return len(self.close)
 
 
 # ---------------- HELPERS ----------------
+IST_OFFSET = dt.timedelta(hours=5, minutes=30)
+
+
 def now_ist():
-    return dt.datetime.utcnow() + dt.timedelta(hours=5, minutes=30)
+    return dt.datetime.utcnow() + IST_OFFSET
+
+
+def token_expiry(token: str):
+    """
+    Read the `exp` claim of a Fyers JWT access token (no signature check).
+    Returns a naive UTC datetime, or None if the token cannot be decoded.
+    """
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        exp = orjson.loads(base64.urlsafe_b64decode(payload)).get("exp")
+        return dt.datetime.utcfromtimestamp(int(exp)) if exp else None
+    except Exception as e:
+        logging.debug("token_expiry error: %s", e)
+        return None
 
 
+@lru_cache(maxsize=4096)
 def _normalize_for_fyers(symbol: str) -> str:
     if not symbol:
         return None
@@ -82,36 +197,47 @@ def _normalize_for_fyers(symbol: str) -> str:
     return f"NSE:{s}-EQ"
 
 
-def get_atr(df: pd.DataFrame, period: int = 14):
+def get_atr(candles: Candles, period: int = 14):
+    """
+    Wilder ATR: seed with the mean of the first `period` true ranges, then apply
+    the RMA (alpha = 1/period) over the rest, evaluated as one weighted dot product.
+    """
     try:
-        if df is None or df.shape[0] < max(3, period + 1):
+        # fetch_ohlc already returns float64 arrays with NaN bars dropped
+        if candles is None or len(candles) < max(3, period + 1):
             return None
-        df = df.copy()
-        for col in ["high", "low", "close"]:
-            df[col] = pd.to_numeric(df[col], errors="coerce")
-        df.dropna(subset=["high", "low", "close"], inplace=True)
-        if df.shape[0] < period:
-            return None
-        high = df["high"]
-        low = df["low"]
-        close = df["close"]
-        tr1 = high - low
-        tr2 = (high - close.shift(1)).abs()
-        tr3 = (low - close.shift(1)).abs()
-        tr = pd.concat([tr1, tr2, tr3], axis=1).max(axis=1)
-        atr = tr.rolling(period).mean().iloc[-1]
+        high = candles.high[1:]
+        low = candles.low[1:]
+        prev_close = candles.close[:-1]
+        tr = np.maximum(high - low, np.maximum(np.abs(high - prev_close), np.abs(low - prev_close)))
+
+        alpha = 1.0 / period
+        rest = tr[period:]
+        decay = (1.0 - alpha) ** np.arange(rest.size - 1, -1, -1)
+        atr = (1.0 - alpha) ** rest.size * tr[:period].mean() + alpha * (decay @ rest)
         return float(atr) if not np.isnan(atr) else None
     except Exception as e:
-        logging.debug(f"get_atr error: {e}")
+        logging.debug("get_atr error: %s", e)
         return None
 
 
-def fetch_ohlc(symbol: str, interval: str = DEFAULT_INTERVAL, lookback_days: int = 7):
+def fetch_ohlc(symbol: str, interval: str = DEFAULT_INTERVAL, lookback_days: int = 7, now: dt.datetime = None):
+    """
+    Candle history for a fyers symbol. Results are reused until the current
+    `interval` bar rolls over, so repeat lookups within one bar skip the REST call.
+    """
     try:
+        bar_seconds = int(interval) * 60 if interval.isdigit() else 86400
+        cache_key = (symbol, interval, lookback_days, int(time.time() // bar_seconds))
+        with candle_cache_lock:
+            cached = candle_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         if fyers is None:
             logging.debug("fetch_ohlc: fyers not initialized.")
             return None
-        now = now_ist()
+        now = now or now_ist()
         params = {
             "symbol": symbol,
             "resolution": interval,
@@ -126,74 +252,213 @@ def fetch_ohlc(symbol: str, interval: str = DEFAULT_INTERVAL, lookback_days: int
         candles = resp.get("candles") if isinstance(resp, dict) else None
         if not candles:
             return None
-        df = pd.DataFrame(candles, columns=["ts", "open", "high", "low", "close", "vol"])
-        for c in ["open", "high", "low", "close", "vol"]:
-            df[c] = pd.to_numeric(df[c], errors="coerce")
-        df.dropna(subset=["open", "high", "low", "close"], inplace=True)
-        return df
+        # one C-level conversion of [ts, o, h, l, c, v] rows into a float64 block
+        arr = np.asarray(candles, dtype=np.float64)
+        if arr.ndim != 2 or arr.shape[1] < 6:
+            return None
+        arr = arr[~np.isnan(arr[:, 1:5]).any(axis=1)]
+        # transpose into one contiguous array per field
+        result = Candles(*np.ascontiguousarray(arr[:, :6].T))
+        with candle_cache_lock:
+            candle_cache[cache_key] = result
+        return result
     except Exception as e:
-        logging.warning(f"fetch_ohlc failed for {symbol}: {e}")
+        logging.warning("fetch_ohlc failed for %s: %s", symbol, e)
         return None
 
 
+def _ltp_from_quote(item):
+    v = item.get("v", {}) if isinstance(item, dict) else {}
+    return v.get("lp") or v.get("ltp") or v.get("last_price")
+
+
+def _quotes_permit():
+    """
+    Circuit breaker gate for fyers.quotes. Returns None while calls are paused,
+    otherwise whether this call is the single half-open probe.
+    """
+    global quotes_probing
+    with quotes_breaker_lock:
+        if not quotes_open_until:
+            return False
+        if time.monotonic() < quotes_open_until or quotes_probing:
+            return None
+        quotes_probing = True
+        return True
+
+
+def _record_quotes_call(ok: bool, probe: bool):
+    """
+    After QUOTES_FAIL_MAX consecutive failures, pause quote calls for
+    QUOTES_COOLDOWN_SEC; then one probe call decides whether to close or re-open.
+    """
+    global quotes_failures, quotes_open_until, quotes_probing
+    with quotes_breaker_lock:
+        if probe:
+            quotes_probing = False
+        if ok:
+            quotes_failures = 0
+            quotes_open_until = 0.0
+            return
+        quotes_failures += 1
+        if probe or quotes_failures >= QUOTES_FAIL_MAX:
+            quotes_open_until = time.monotonic() + QUOTES_COOLDOWN_SEC
+            quotes_failures = 0
+            logging.warning("Quotes failing; pausing quote calls for %ss.", QUOTES_COOLDOWN_SEC)
+
+
+def _quotes_ok(q) -> bool:
+    # error responses (rate limit, auth) also arrive as dicts, with s != "ok"
+    return isinstance(q, dict) and q.get("s") == "ok"
+
+
 def get_ltp(symbol: str):
+    """
+    Last traded price for a fyers symbol.
+    Results are kept for LTP_CACHE_TTL seconds so overlapping lookups share one quote call.
+    """
     try:
+        with ltp_cache_lock:
+            cached = ltp_cache.get(symbol)
+        if cached is not None:
+            return cached
+
         if fyers is None:
             logging.debug("get_ltp: fyers not initialized.")
             return None
-        q = fyers.quotes({"symbols": symbol})
+        probe = _quotes_permit()
+        if probe is None:
+            return None
+        try:
+            q = fyers.quotes({"symbols": symbol})
+        except Exception:
+            _record_quotes_call(False, probe)
+            raise
+        _record_quotes_call(_quotes_ok(q), probe)
         if not isinstance(q, dict):
             return None
+        ltp = None
         if "d" in q and isinstance(q["d"], list) and q["d"]:
-            item = q["d"][0]
-            v = item.get("v", {}) if isinstance(item, dict) else {}
-            ltp = v.get("lp") or v.get("ltp") or v.get("last_price")
-            if ltp is not None:
-                return float(ltp)
-        if "ltp" in q:
-            return float(q["ltp"])
-        return None
+            ltp = _ltp_from_quote(q["d"][0])
+        if ltp is None and "ltp" in q:
+            ltp = q["ltp"]
+        if ltp is None:
+            return None
+
+        ltp = float(ltp)
+        with ltp_cache_lock:
+            ltp_cache[symbol] = ltp
+        return ltp
     except Exception as e:
-        logging.debug(f"LTP error for {symbol}: {e}")
+        logging.debug("LTP error for %s: %s", symbol, e)
         return None
 
 
+def get_ltps(symbols):
+    """
+    Last traded prices for several fyers symbols, one quotes call per QUOTES_BATCH_SIZE.
+    Cached prices are reused; symbols a successful batch left out are retried with get_ltp.
+    Symbols still without a quote are left out of the result.
+    """
+    result = {}
+    with ltp_cache_lock:
+        for sym in symbols:
+            cached = ltp_cache.get(sym)
+            if cached is not None:
+                result[sym] = cached
+    missing = [sym for sym in symbols if sym not in result]
+    if not missing:
+        return result
+    if fyers is None:
+        logging.debug("get_ltps: fyers not initialized.")
+        return result
+
+    residual = []
+    for i in range(0, len(missing), QUOTES_BATCH_SIZE):
+        probe = _quotes_permit()
+        if probe is None:
+            return result  # breaker open: cached prices only, retried next tick
+        batch = missing[i:i + QUOTES_BATCH_SIZE]
+        try:
+            try:
+                q = fyers.quotes({"symbols": ",".join(batch)})
+            except Exception:
+                _record_quotes_call(False, probe)
+                raise
+            _record_quotes_call(_quotes_ok(q), probe)
+            items = q.get("d") if isinstance(q, dict) else None
+            if not isinstance(items, list):
+                continue
+            fetched = {}
+            for item in items:
+                if not isinstance(item, dict):
+                    continue
+                name = item.get("n") or item.get("v", {}).get("symbol")
+                ltp = _ltp_from_quote(item)
+                if name and ltp is not None:
+                    fetched[name] = float(ltp)
+            with ltp_cache_lock:
+                ltp_cache.update(fetched)
+            result.update(fetched)
+            residual.extend(sym for sym in batch if sym not in fetched)
+        except Exception as e:
+            logging.debug("Batch LTP error for %s: %s", batch, e)
+
+    # only symbols a batch answered without — a failed batch is not re-sent one by one;
+    # the singles run side by side so the miss set costs one round trip, not one each
+    if len(residual) == 1:
+        ltp = get_ltp(residual[0])
+        if ltp is not None:
+            result[residual[0]] = ltp
+    elif residual:
+        for sym, ltp in zip(residual, ltp_pool.map(get_ltp, residual)):
+            if ltp is not None:
+                result[sym] = ltp
+    return result
+
+
 # ---------------- TRADING CORE ----------------
+# Fixed fields of a market INTRADAY order; place_order only fills symbol/qty/side.
+_ORDER_TEMPLATE = {
+    "type": 2,
+    "productType": "INTRADAY",
+    "limitPrice": 0,
+    "stopPrice": 0,
+    "validity": "DAY"
+}
+
+
 def calculate_sl_tgt(entry: float, atr: float):
     try:
         if atr and STOP_METHOD == "ATR":
             sl = entry - (ATR_MULT * atr)
             tgt = entry + (ATR_TARGET_MULT * atr)
         else:
-            sl = entry * (1 - SL_PCT / 100)
-            tgt = entry * (1 + TARGET_PCT / 100)
+            sl = entry * SL_FACTOR
+            tgt = entry * TARGET_FACTOR
         return round(sl, 2), round(tgt, 2)
     except Exception as e:
-        logging.debug(f"calculate_sl_tgt error: {e}")
-        return round(entry * (1 - SL_PCT / 100), 2), round(entry * (1 + TARGET_PCT / 100), 2)
+        logging.debug("calculate_sl_tgt error: %s", e)
+        return round(entry * SL_FACTOR, 2), round(entry * TARGET_FACTOR, 2)
 
 
 def place_order(symbol: str, price: float, qty: int, side: str):
     try:
         if TRADE_MODE == "REAL":
-            order = {
+            order = _ORDER_TEMPLATE | {
                 "symbol": symbol,
                 "qty": qty,
-                "type": 2,
-                "side": 1 if side == "BUY" else -1,
-                "productType": "INTRADAY",
-                "limitPrice": 0,
-                "stopPrice": 0,
-                "validity": "DAY"
+                "side": 1 if side == "BUY" else -1
             }
-            resp = fyers.place_order(order)
-            logging.info(f"REAL {side} placed for {symbol}: {resp}")
+            with broker_slots:
+                resp = fyers.place_order(order)
+            logging.info("REAL %s placed for %s: %s", side, symbol, resp)
             return resp
         else:
-            logging.info(f"TEST {side} simulated for {symbol} @ {price} (qty={qty})")
+            logging.info("TEST %s simulated for %s @ %s (qty=%s)", side, symbol, price, qty)
             return {"s": "ok", "mode": "TEST_SIM"}
     except Exception as e:
-        logging.error(f"Order failed {symbol}: {e}")
+        logging.error("Order failed %s: %s", symbol, e)
         return {"s": "error", "error": str(e)}
 
 
@@ -201,37 +466,50 @@ def secure_place_thread(symbol: str, price: float):
     try:
         resolved = _normalize_for_fyers(symbol)
         if not resolved:
-            logging.warning(f"Invalid symbol provided: {symbol}")
+            logging.warning("Invalid symbol provided: %s", symbol)
             return
 
-        with lock:
-            key = symbol.strip().upper()
-            if key in open_positions:
-                logging.info(f"Duplicate {key} ignored (already open).")
-                return
+        # Duplicate checks rely on single dict operations being atomic, so the
+        # candle fetch below runs without holding `lock`.
+        key = symbol.strip().upper()
+        claim = object()
+        if key in open_positions or pending_entries.setdefault(key, claim) is not claim:
+            logging.info("Duplicate %s ignored (already open).", key)
+            return
 
-            df = fetch_ohlc(resolved, interval=DEFAULT_INTERVAL, lookback_days=7)
-            atr = get_atr(df, ATR_PERIOD) if df is not None else None
+        try:
+            opened_at = now_ist()  # one clock read per alert; also the position timestamp
+            candles = fetch_ohlc(resolved, interval=DEFAULT_INTERVAL, lookback_days=7, now=opened_at)
+            atr = get_atr(candles, ATR_PERIOD) if candles is not None else None
 
             sl, tgt = calculate_sl_tgt(price, atr)
             qty = 1
 
-            open_positions[key] = {
-                "symbol": key,
-                "fyers_symbol": resolved,
-                "entry_price": float(price),
-                "atr": atr,
-                "stop_loss": sl,
-                "target": tgt,
-                "qty": qty,
-                "timestamp": now_ist().isoformat(),
-                "status": f"{TRADE_MODE}_OPEN",
-            }
+            pos = Position(
+                symbol=key,
+                fyers_symbol=resolved,
+                entry_price=float(price),
+                atr=atr,
+                stop_loss=sl,
+                target=tgt,
+                trail_start=float(price) * TRAIL_START_FACTOR,
+                qty=qty,
+                timestamp=opened_at.isoformat(),
+                status=f"{TRADE_MODE}_OPEN",
+            )
+            if open_positions.setdefault(key, pos) is not pos:
+                logging.info("Duplicate %s ignored (already open).", key)
+                return
+        finally:
+            pending_entries.pop(key, None)
+
+        if app_loop is not None:
+            app_loop.call_soon_threadsafe(position_opened.set)
 
         place_order(resolved, price, qty, "BUY")
-        logging.info(f"{key} opened @ {price}, SL {sl}, TGT {tgt}")
+        logging.info("%s opened @ %s, SL %s, TGT %s", key, price, sl, tgt)
     except Exception as e:
-        logging.error(f"secure_place_thread error for {symbol}: {e}", exc_info=True)
+        logging.error("secure_place_thread error for %s: %s", symbol, e, exc_info=True)
 
 
 # ---------------- New helpers: candle-based and trailing/time exit ----------------
@@ -242,45 +520,42 @@ def candle_stop_hit(fyers_symbol: str):
     - Checks only the *last closed candle*.
     """
     try:
-        df = fetch_ohlc(fyers_symbol, interval=DEFAULT_INTERVAL, lookback_days=1)
-        if df is None or len(df) < 3:
+        candles = fetch_ohlc(fyers_symbol, interval=DEFAULT_INTERVAL, lookback_days=1)
+        if candles is None or len(candles) < 3:
             return False
 
-        prev = df.iloc[-2]  # previous closed candle
-        last = df.iloc[-1]  # last closed candle
-
-        prev_open = float(prev["open"])
-        last_close = float(last["close"])
+        prev_open = candles.open[-2]  # previous closed candle
+        last_close = candles.close[-1]  # last closed candle
         deviation_pct = ((prev_open - last_close) / prev_open) * 100
 
         if last_close < prev_open and deviation_pct >= 0.2:
-            logging.info(f"📉 Confirmed Candle SL: {fyers_symbol} close {last_close} < prev_open {prev_open} ({deviation_pct:.2f}%)")
+            logging.info("📉 Confirmed Candle SL: %s close %s < prev_open %s (%.2f%%)", fyers_symbol, last_close, prev_open, deviation_pct)
             return True
 
         return False
     except Exception as e:
-        logging.debug(f"confirmed candle_stop_hit error {fyers_symbol}: {e}")
+        logging.debug("confirmed candle_stop_hit error %s: %s", fyers_symbol, e)
         return False
 
 
-def apply_trailing_stop(key: str, pos: dict, ltp: float):
+def apply_trailing_stop(key: str, pos: Position, ltp: float):
     """
     Move stop loss in-place depending on TRAIL_TYPE.
     - PCT: sets stop to max(current stop, ltp * (1 - TRAIL_PCT/100)) once price moved TRAIL_START_PCT above entry.
     - ATR: sets stop to max(current stop, ltp - ATR_MULT * atr) once price moved TRAIL_START_PCT above entry.
     """
     try:
-        entry = float(pos["entry_price"])
-        current_stop = float(pos.get("stop_loss"))
-        atr = float(pos.get("atr")) if pos.get("atr") else None
-
         # only start trailing after price moved favorably by TRAIL_START_PCT
-        if ltp < entry * (1 + TRAIL_START_PCT / 100):
+        if ltp < pos.trail_start:
             return False  # not yet eligible to trail
 
+        # Position fields are stored as native floats (or None for atr) at entry
+        current_stop = pos.stop_loss
+        atr = pos.atr
+
         new_stop = current_stop
         if TRAIL_TYPE == "PCT":
-            candidate = round(ltp * (1 - TRAIL_PCT / 100), 2)
+            candidate = round(ltp * TRAIL_FACTOR, 2)
             if candidate > new_stop:
                 new_stop = candidate
         elif TRAIL_TYPE == "ATR" and atr:
@@ -291,13 +566,12 @@ def apply_trailing_stop(key: str, pos: dict, ltp: float):
         if new_stop > current_stop:
             with lock:
                 if key in open_positions:
-                    open_positions[key]["stop_loss"] = new_stop
-                    open_positions[key]["atr"] = atr  # refresh
-            logging.info(f"Trailing stop moved for {key}: {current_stop} -> {new_stop}")
+                    open_positions[key].stop_loss = new_stop
+            logging.info("Trailing stop moved for %s: %s -> %s", key, current_stop, new_stop)
             return True
         return False
     except Exception as e:
-        logging.debug(f"apply_trailing_stop error for {key}: {e}")
+        logging.debug("apply_trailing_stop error for %s: %s", key, e)
         return False
 
 
@@ -309,130 +583,210 @@ def secure_square_off(key: str, fyers_sym: str, ltp: float, reason: str):
         with lock:
             pos = open_positions.get(key)
             if not pos:
-                logging.warning(f"secure_square_off: no pos for {key}")
+                logging.warning("secure_square_off: no pos for %s", key)
                 return
             # if already exited, skip
-            if pos.get("status", "").startswith(f"{TRADE_MODE}_EXIT"):
-                logging.info(f"{key} already exited with status {pos.get('status')}")
+            if pos.status.startswith(EXIT_STATUS_PREFIX):
+                logging.info("%s already exited with status %s", key, pos.status)
                 return
-            qty = int(pos.get("qty", 1))
+            qty = int(pos.qty)
 
         place_order(fyers_sym, ltp, qty, "SELL")
 
         with lock:
-            if key in open_positions:
-                open_positions[key].update({
-                    "exit_price": float(ltp),
-                    "exit_reason": reason,
-                    "status": f"{TRADE_MODE}_EXIT_{reason}",
-                    "exit_timestamp": now_ist().isoformat()
-                })
-        logging.info(f"{key} squared off ({reason}) @ {ltp}")
+            pos = open_positions.get(key)
+            if pos:
+                pos.exit_price = float(ltp)
+                pos.exit_reason = reason
+                pos.status = f"{EXIT_STATUS_PREFIX}_{reason}"
+                pos.exit_timestamp = now_ist().isoformat()
+        logging.info("%s squared off (%s) @ %s", key, reason, ltp)
     except Exception as e:
-        logging.error(f"secure_square_off error for {key}: {e}", exc_info=True)
+        logging.error("secure_square_off error for %s: %s", key, e, exc_info=True)
 
 
 # ---------------- EXIT MONITOR ----------------
-def monitor_exits():
+async def monitor_exits():
     logging.info("Exit monitor running.")
+    last_checked_bar = int(time.time() // BAR_SECONDS)  # bucket the confirmed-candle SL last ran in
     while True:
+        tick_start = time.monotonic()
         try:
+            position_opened.clear()  # before the snapshot, so a concurrent entry is never missed
             with lock:
                 snapshot = dict(open_positions)
 
             now = now_ist()
-            try:
-               interval_min = int(DEFAULT_INTERVAL) if DEFAULT_INTERVAL.isdigit() else 15
-            except Exception:
-               interval_min = 15
-
-            check_candle_exit = USE_CANDLE_SL and (now.minute % interval_min == 0 and now.second < 10)
 
-            for key, pos in snapshot.items():
+            active = {
+                key: pos.fyers_symbol or _normalize_for_fyers(key)
+                for key, pos in snapshot.items()
+                if not pos.status.startswith(EXIT_STATUS_PREFIX)
+            }
+            if not active:
+                await position_opened.wait()  # idle until secure_place_thread opens a position
+                # the bar in progress isn't closed yet; first candle check is after it rolls over
+                last_checked_bar = int(time.time() // BAR_SECONDS)
+                continue
+
+            # confirmed-candle SL once per bar, on the first tick after the bar rolls over
+            bar = int(time.time() // BAR_SECONDS)
+            check_candle_exit = USE_CANDLE_SL and bar != last_checked_bar
+
+            # one quotes round-trip for the whole book
+            ltps = await asyncio.to_thread(get_ltps, list(set(active.values())))
+
+            # Exit decisions for the whole book as boolean masks; only flagged rows are visited.
+            # Masks use the stop as of this tick, before any trailing update below.
+            keys = [key for key, fyers_sym in active.items() if fyers_sym in ltps]
+            n = len(keys)
+            positions = [snapshot[key] for key in keys]
+            ltp_arr = np.fromiter((ltps[active[key]] for key in keys), dtype=np.float64, count=n)
+            stops = np.fromiter((p.stop_loss for p in positions), dtype=np.float64, count=n)
+            targets = np.fromiter((p.target for p in positions), dtype=np.float64, count=n)
+            trail_starts = np.fromiter((p.trail_start for p in positions), dtype=np.float64, count=n)
+            elapsed_min = np.fromiter(
+                ((now - dt.datetime.fromisoformat(p.timestamp)).total_seconds() / 60.0 for p in positions),
+                dtype=np.float64, count=n,
+            )
+
+            trail_mask = ltp_arr >= trail_starts
+            time_mask = elapsed_min >= TIME_EXIT_MIN
+            sl_mask = ltp_arr <= stops
+            tgt_mask = ltp_arr >= targets
+            act_mask = trail_mask | time_mask | sl_mask | tgt_mask | check_candle_exit
+
+            exits = []  # (key, fyers_sym, ltp, reason) squared off together after the scan
+            for i in np.flatnonzero(act_mask):
+                key = keys[i]
+                pos = positions[i]
+                fyers_sym = active[key]
+                ltp = float(ltp_arr[i])
                 try:
-                    if pos.get("status", "").startswith(f"{TRADE_MODE}_EXIT"):
-                        continue
-
-                    fyers_sym = pos.get("fyers_symbol") or _normalize_for_fyers(key)
-                    ltp = get_ltp(fyers_sym)
-                    if ltp is None:
-                        continue
-
-                    sl = float(pos.get("stop_loss"))
-                    tgt = float(pos.get("target"))
-
                     # 1️⃣ Trailing stop
-                    apply_trailing_stop(key, pos, ltp)
+                    if trail_mask[i]:
+                        apply_trailing_stop(key, pos, ltp)
 
                     # 2️⃣ Time-based exit
-                    entry_time = dt.datetime.fromisoformat(pos["timestamp"])
-                    elapsed_minutes = (now - entry_time).total_seconds() / 60.0
-                    if elapsed_minutes >= TIME_EXIT_MIN:
-                        secure_square_off(key, fyers_sym, ltp, "TIME_EXIT")
+                    if time_mask[i]:
+                        exits.append((key, fyers_sym, ltp, "TIME_EXIT"))
                         continue
 
-                    # 3️⃣ Confirmed candle SL — only once every 15 min after candle close
+                    # 3️⃣ Confirmed candle SL — once per bar, after the candle closes
                     if check_candle_exit:
-                        if candle_stop_hit(fyers_sym):
-                            secure_square_off(key, fyers_sym, ltp, "CANDLE_SL_CONFIRMED")
+                        if await asyncio.to_thread(candle_stop_hit, fyers_sym):
+                            exits.append((key, fyers_sym, ltp, "CANDLE_SL_CONFIRMED"))
                             continue
 
                     # 4️⃣ ATR / regular SL and Target checks
-                    if ltp <= sl:
-                        secure_square_off(key, fyers_sym, ltp, "SL_HIT")
+                    if sl_mask[i]:
+                        exits.append((key, fyers_sym, ltp, "SL_HIT"))
                         continue
-                    elif ltp >= tgt:
-                        secure_square_off(key, fyers_sym, ltp, "TGT_HIT")
+                    elif tgt_mask[i]:
+                        exits.append((key, fyers_sym, ltp, "TGT_HIT"))
                         continue
 
                 except Exception as e:
-                    logging.debug(f"monitor_exits inner error for {key}: {e}", exc_info=True)
+                    logging.debug("monitor_exits inner error for %s: %s", key, e, exc_info=True)
+
+            if check_candle_exit and n:
+                last_checked_bar = bar  # only once the check has run over quoted positions
+
+            # concurrent SELLs (bounded by broker_slots) so one slow order doesn't delay the rest
+            if exits:
+                await asyncio.gather(*(asyncio.to_thread(secure_square_off, *args) for args in exits))
 
         except Exception as e:
-            logging.warning(f"monitor_exits error: {e}", exc_info=True)
+            logging.warning("monitor_exits error: %s", e, exc_info=True)
 
-        time.sleep(15)
+        # fixed cadence: time spent on quotes and orders comes out of the wait, not on top of it
+        await asyncio.sleep(max(0.0, MONITOR_INTERVAL_SEC - (time.monotonic() - tick_start)))
 
 
 
+# ---------------- TOKEN REFRESH ----------------
+async def token_refresher():
+    """
+    Renew the access token TOKEN_REFRESH_LEAD_SEC before it expires and rebuild the
+    fyers session, so orders never run against an expired token.
+    """
+    global FYERS_ACCESS_TOKEN
+    while True:
+        expiry = token_expiry(FYERS_ACCESS_TOKEN)
+        if expiry is None:
+            logging.warning("⚠️ Could not read access token expiry — proactive refresh disabled.")
+            return
+
+        delay = (expiry - dt.datetime.utcnow()).total_seconds() - TOKEN_REFRESH_LEAD_SEC
+        logging.info("🔑 Access token expires %s UTC; refresh in %.0fs.", expiry.isoformat(), max(0, delay))
+        await asyncio.sleep(max(0, delay))
+
+        try:
+            FYERS_ACCESS_TOKEN = await asyncio.to_thread(fetch_access_token)
+            init_fyers()
+            logging.info("🔑 Fyers session re-initialized with refreshed token.")
+            new_expiry = token_expiry(FYERS_ACCESS_TOKEN)
+            if new_expiry is not None and new_expiry <= dt.datetime.utcnow() + dt.timedelta(seconds=TOKEN_REFRESH_LEAD_SEC):
+                # an already-near-expiry token would otherwise make the loop refresh back to back
+                logging.warning("⚠️ Refreshed token still expires %s UTC; retrying in %ss.", new_expiry.isoformat(), TOKEN_RETRY_SEC)
+                await asyncio.sleep(TOKEN_RETRY_SEC)
+        except Exception as e:
+            logging.error("Token refresh failed: %s", e, exc_info=True)
+            await asyncio.sleep(TOKEN_RETRY_SEC)  # retry shortly
+
+
 # ---------------- EMAIL SUMMARY ----------------
+# Columns of the emailed report and shutdown snapshot; trail_start is internal and left out.
+REPORT_FIELDS = (
+    "symbol", "fyers_symbol", "entry_price", "atr", "stop_loss", "target", "qty",
+    "timestamp", "status", "exit_price", "exit_reason", "exit_timestamp",
+)
+
+
+def build_report_xlsx(positions):
+    """
+    Write positions (one row each, REPORT_FIELDS + P&L) straight to an in-memory .xlsx.
+    """
+    buffer = io.BytesIO()
+    wb = xlsxwriter.Workbook(buffer, {"in_memory": True})
+    ws = wb.add_worksheet()
+    ws.write_row(0, 0, REPORT_FIELDS + ("P&L",))
+    for row, p in enumerate(positions, start=1):
+        pnl = (p.exit_price - p.entry_price) * p.qty if "EXIT" in p.status and p.exit_price is not None else 0
+        ws.write_row(row, 0, [getattr(p, name) for name in REPORT_FIELDS] + [pnl])
+    wb.close()
+    return buffer.getvalue()
+
+
 def email_summary():
-    if not EMAIL_USER or not EMAIL_PASS or not EMAIL_TO:
+    if not EMAIL_USER or not EMAIL_PASS or not EMAIL_RECIPIENTS:
         logging.warning("Email credentials not configured.")
         return
     try:
         with lock:
-            df = pd.DataFrame(open_positions).T
+            positions = list(open_positions.values())
 
-        if df.empty:
+        if not positions:
             logging.info("No trades today to email.")
             return
 
-        df["P&L"] = np.where(
-            df["status"].str.contains("EXIT"),
-            (df["exit_price"].astype(float) - df["entry_price"].astype(float)) * df["qty"].astype(float),
-            0,
-        )
-
-        xfile = os.path.join(tempfile.gettempdir(), "daily_report.xlsx")
-        df.to_excel(xfile, index=False)
+        report = build_report_xlsx(positions)
 
         msg = MIMEMultipart()
         msg["From"] = EMAIL_USER
-        msg["To"] = EMAIL_TO
+        msg["To"] = ", ".join(EMAIL_RECIPIENTS)
         msg["Subject"] = f"Daily Trade Report {now_ist().date()}"
         msg.attach(MIMEText("Attached daily trade summary.", "plain"))
-        with open(xfile, "rb") as f:
-            msg.attach(MIMEApplication(f.read(), Name="daily_report.xlsx"))
+        msg.attach(MIMEApplication(report, Name="daily_report.xlsx"))
 
         with smtplib.SMTP("smtp.gmail.com", 587) as s:
             s.starttls()
             s.login(EMAIL_USER, EMAIL_PASS)
-            s.send_message(msg)
+            s.send_message(msg, to_addrs=EMAIL_RECIPIENTS)  # one session/transfer for all recipients
 
         logging.info("Daily report email sent.")
     except Exception as e:
-        logging.error(f"Email send failed: {e}", exc_info=True)
+        logging.error("Email send failed: %s", e, exc_info=True)
 
 
 # ---------------- API ENDPOINTS ----------------
@@ -450,29 +804,38 @@ def test_email():
         email_summary()
         return {"status": "success", "message": "Email triggered successfully ✅"}
     except Exception as e:
-        logging.error(f"Test email failed: {e}", exc_info=True)
+        logging.error("Test email failed: %s", e, exc_info=True)
         return {"status": "error", "message": str(e)} 
     
 
 
 @app.post("/chartink")
 async def chartink_webhook(request: Request):
+    digest = None
     try:
-        data = await request.json()
-        logging.info(f"📩 Incoming Chartink webhook: {json.dumps(data)}")
+        body = await request.body()
+        digest = hashlib.blake2b(body, digest_size=16).digest()
+        if digest in seen_alerts:
+            logging.info("🔁 Duplicate Chartink alert ignored.")
+            return {"status": "duplicate"}
+        seen_alerts[digest] = True
+
+        data = orjson.loads(body)
+        if logging.getLogger().isEnabledFor(logging.INFO):
+            logging.info("📩 Incoming Chartink webhook: %s", orjson.dumps(data).decode())
 
         if isinstance(data, dict) and ("stocks" in data or "trigger_prices" in data):
             stocks = data.get("stocks", "")
             prices = data.get("trigger_prices", "")
+            # parse the whole payload before dispatching, so a bad price can't leave a partial batch
             stock_list = [s.strip() for s in stocks.split(",") if s.strip()]
             price_list = [float(p.strip()) for p in prices.split(",") if p.strip()]
-            for i, symbol in enumerate(stock_list):
-                price = price_list[i] if i < len(price_list) else 0
+            for symbol, price in itertools.zip_longest(stock_list, price_list[:len(stock_list)], fillvalue=0):
                 if price > 0:
-                    logging.info(f"✅ Trigger received → {symbol} @ {price}")
-                    threading.Thread(target=secure_place_thread, args=(symbol, price), daemon=True).start()
+                    logging.info("✅ Trigger received → %s @ %s", symbol, price)
+                    order_pool.submit(secure_place_thread, symbol, price)
                 else:
-                    logging.warning(f"⚠️ Missing price for {symbol} in Chartink payload")
+                    logging.warning("⚠️ Missing price for %s in Chartink payload", symbol)
             return {"status": "ok"}
 
         if isinstance(data, list):
@@ -480,30 +843,33 @@ async def chartink_webhook(request: Request):
                 symbol = item.get("symbol") or item.get("stocks")
                 price = float(item.get("price") or item.get("trigger_prices") or 0)
                 if symbol and price > 0:
-                    logging.info(f"✅ Trigger received → {symbol} @ {price}")
-                    threading.Thread(target=secure_place_thread, args=(symbol, price), daemon=True).start()
+                    logging.info("✅ Trigger received → %s @ %s", symbol, price)
+                    order_pool.submit(secure_place_thread, symbol, price)
             return {"status": "ok"}
 
         symbol = data.get("symbol") or data.get("stocks") or ""
         price = float(data.get("price") or data.get("trigger_prices") or 0)
         if symbol and price > 0:
-            logging.info(f"✅ Trigger received → {symbol} @ {price}")
-            threading.Thread(target=secure_place_thread, args=(symbol, price), daemon=True).start()
+            logging.info("✅ Trigger received → %s @ %s", symbol, price)
+            order_pool.submit(secure_place_thread, symbol, price)
             return {"status": "ok"}
 
-        logging.warning(f"⚠️ Unrecognized payload: {data}")
+        logging.warning("⚠️ Unrecognized payload: %s", data)
         return {"status": "ignored", "payload": data}
 
     except Exception as e:
-        logging.error(f"❌ Error processing webhook: {e}", exc_info=True)
+        logging.error("❌ Error processing webhook: %s", e, exc_info=True)
+        if digest is not None:
+            seen_alerts.pop(digest, None)  # let Chartink's retry of a failed alert through
         return {"status": "error", "message": str(e)}
 
 
 # ---------------- STARTUP & SHUTDOWN ----------------
 @app.on_event("startup")
-def startup_event():
-    global open_positions, fyers
-    logging.info(f"🚀 Starting Chartink Webhook Service... (Mode: {TRADE_MODE})")
+async def startup_event():
+    global open_positions, fyers, app_loop, monitor_task, token_refresh_task, heartbeat_task, report_task
+    logging.info("🚀 Starting Chartink Webhook Service... (Mode: %s)", TRADE_MODE)
+    app_loop = asyncio.get_running_loop()
     open_positions = {}
 
     try:
@@ -513,66 +879,91 @@ def startup_event():
         else:
             logging.warning("⚠️ FYERS_ACCESS_TOKEN not set — LTP/ohlc calls will fail until provided.")
     except Exception as e:
-        logging.error(f"Fyers init error: {e}", exc_info=True)
+        logging.error("Fyers init error: %s", e, exc_info=True)
 
-    # 🧠 Exit monitor thread
-    threading.Thread(target=monitor_exits, daemon=True).start()
+    # 🔑 Proactive token refresh (needs FYERS_REFRESH_TOKEN)
+    if FYERS_ACCESS_TOKEN and FYERS_REFRESH_TOKEN:
+        token_refresh_task = asyncio.create_task(token_refresher())
+    elif FYERS_ACCESS_TOKEN:
+        logging.info("🔑 Access token expires %s UTC (no refresh token configured).", token_expiry(FYERS_ACCESS_TOKEN))
+
+    # 🧠 Exit monitor task (runs on the app event loop)
+    monitor_task = asyncio.create_task(monitor_exits())
     logging.info("🧠 Exit monitor started (hybrid SL/TGT tracking active).")
 
-    # 💓 Heartbeat thread
-    def heartbeat():
+    # 💓 Heartbeat task
+    async def heartbeat():
         while True:
-            logging.info("💓 Heartbeat: app alive")
-            time.sleep(300)
-    threading.Thread(target=heartbeat, daemon=True).start()
+            logging.info("💓 Heartbeat: app alive | open=%s entering=%s", len(open_positions), len(pending_entries))
+            await asyncio.sleep(300)
+    heartbeat_task = asyncio.create_task(heartbeat())
+
+    # 📧 Daily email scheduler task
+    report_task = asyncio.create_task(daily_report_scheduler())
+
 
-    # 📧 Daily Email Scheduler Thread
-def daily_report_scheduler():
-    logging.info("📧 Daily report scheduler thread started.")
-    last_report_date = None
+def _next_ist(now: dt.datetime, hour: int, minute: int) -> dt.datetime:
+    """Next IST datetime strictly after `now` at hour:minute."""
+    at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return at if at > now else at + dt.timedelta(days=1)
+
+
+async def daily_report_scheduler():
+    """
+    Sleeps straight to the next daily event instead of polling the clock:
+    - 15:31 IST: email the daily summary (market close)
+    - 09:00 IST: clear open_positions for the new trading day
+    """
+    logging.info("📧 Daily report scheduler started.")
+    last_fired = {}  # event -> IST date it last ran, so an early wake-up can't fire it twice
 
     while True:
         try:
             now = now_ist()
+            due, event = min((_next_ist(now, *REPORT_AT), "report"), (_next_ist(now, *RESET_AT), "reset"))
+            await asyncio.sleep(max(0.0, (due - now_ist()).total_seconds()))
+            if last_fired.get(event) == due.date():
+                continue
+            last_fired[event] = due.date()
 
             # 1️⃣ Send report once daily at 15:31 IST (market close)
-            if now.hour == 15 and now.minute == 31 and (last_report_date != now.date()):
+            if event == "report":
                 logging.info("📧 Triggering daily email summary...")
                 try:
-                    email_summary()
-                    last_report_date = now.date()  # prevent multiple sends in same day
+                    await asyncio.to_thread(email_summary)
                 except Exception as e:
-                    logging.error(f"Email summary failed: {e}", exc_info=True)
-                time.sleep(90)  # wait to avoid double-triggering
+                    logging.error("Email summary failed: %s", e, exc_info=True)
 
             # 2️⃣ Clear open_positions every morning at 09:00 IST
-            if now.hour == 9 and now.minute == 0 and now.second < 10:
+            else:
                 with lock:
                     if open_positions:
-                        logging.info(f"🧹 Clearing {len(open_positions)} positions for new trading day.")
+                        logging.info("🧹 Clearing %s positions for new trading day.", len(open_positions))
                         open_positions.clear()
-                time.sleep(70)  # prevent multiple clears in that minute
-
-            time.sleep(5)
 
         except Exception as e:
-            logging.error(f"daily_report_scheduler loop error: {e}", exc_info=True)
-            time.sleep(10)  # safety pause to prevent crash loop
-
+            logging.error("daily_report_scheduler loop error: %s", e, exc_info=True)
+            await asyncio.sleep(10)  # safety pause to prevent crash loop
 
-# Start scheduler in background
-threading.Thread(target=daily_report_scheduler, daemon=True).start()
 
 @app.on_event("shutdown")
 def shutdown_event():
     logging.info("🛑 Shutting down Chartink Webhook Service... saving summary to logs.")
     try:
         with lock:
-            snapshot = dict(open_positions)
+            snapshot = orjson.dumps(
+                {key: {name: getattr(p, name) for name in REPORT_FIELDS} for key, p in open_positions.items()}
+            ) if open_positions else None
         if snapshot:
-            logging.info(f"Open positions at shutdown: {json.dumps(snapshot)}")
+            logging.info("Open positions at shutdown: %s", snapshot.decode())
     except Exception:
         logging.debug("Error producing shutdown snapshot", exc_info=True)
+    for task in (monitor_task, token_refresh_task, heartbeat_task, report_task):
+        if task is not None:
+            task.cancel()
+    order_pool.shutdown(wait=False, cancel_futures=True)
+    ltp_pool.shutdown(wait=False, cancel_futures=True)
+    log_listener.stop()  # flush queued records before exit
 
 
 # ---------------- FYERS INIT FUNCTION ----------------
@@ -586,8 +977,8 @@ if __name__ == "__main__":
     try:
         if FYERS_ACCESS_TOKEN:
             init_fyers()
-        threading.Thread(target=monitor_exits, daemon=True).start()
         port = int(os.getenv("PORT", 8000))
-        uvicorn.run(app, host="0.0.0.0", port=port)
+        # Single worker: positions and the exit monitor live in this process.
+        uvicorn.run(app, host="0.0.0.0", port=port, loop="uvloop", http="httptools")
     except Exception as e:
-        logging.error(f"Failed to run app: {e}", exc_info=True)
+        logging.error("Failed to run app: %s", e, exc_info=True)
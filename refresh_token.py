@@ -1,14 +1,21 @@
 import os
 import requests
 import logging
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 FYERS_APP_ID = os.getenv("FYERS_APP_ID")
 FYERS_APP_SECRET = os.getenv("FYERS_APP_SECRET")
 FYERS_REFRESH_TOKEN = os.getenv("FYERS_REFRESH_TOKEN")
 RENDER_SERVICE_ID = os.getenv("RENDER_SERVICE_ID")
 RENDER_API_KEY = os.getenv("RENDER_API_KEY")
+HTTP_TIMEOUT = 10  # seconds per request
 
-def refresh_fyers_token():
+# Shared session: keeps TLS connections to Fyers/Render alive across calls
+HTTP = requests.Session()
+HTTP.mount("https://", HTTPAdapter(pool_maxsize=10, max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=(502, 503, 504))))
+
+def fetch_access_token():
     url = "https://api-t1.fyers.in/api/v3/validate-refresh-token"
     data = {
         "appId": FYERS_APP_ID,
@@ -16,7 +23,7 @@ def refresh_fyers_token():
         "refresh_token": FYERS_REFRESH_TOKEN
     }
 
-    resp = requests.post(url, json=data)
+    resp = HTTP.post(url, json=data, timeout=HTTP_TIMEOUT)
     resp.raise_for_status()
     token_data = resp.json()
 
@@ -24,13 +31,17 @@ def refresh_fyers_token():
         raise Exception(f"Token refresh failed: {token_data}")
 
     new_access_token = token_data["access_token"]
-    logging.info(f"✅ New access token fetched: {new_access_token[:20]}...")
+    logging.info("✅ New access token fetched: %s...", new_access_token[:20])
+    return new_access_token
+
+def refresh_fyers_token():
+    new_access_token = fetch_access_token()
 
     # Update Render environment variable
     render_url = f"https://api.render.com/v1/services/{RENDER_SERVICE_ID}/env-vars"
     headers = {"Authorization": f"Bearer {RENDER_API_KEY}"}
     payload = [{"key": "FYERS_ACCESS_TOKEN", "value": new_access_token}]
-    r = requests.put(render_url, headers=headers, json=payload)
+    r = HTTP.put(render_url, headers=headers, json=payload, timeout=HTTP_TIMEOUT)
     r.raise_for_status()
     logging.info("✅ Updated Render environment variable.")
 